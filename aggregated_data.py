@@ -4,29 +4,266 @@
 """
 
 import logging
+import time
 from datetime import datetime, timedelta
-import pytz
-from sqlalchemy import func, and_
+from zoneinfo import ZoneInfo
+import orjson
+from sqlalchemy import func, text
 from flask import current_app as app
 
-from models import db, StoreStatus, DailyStats
+from models import (db, DailyStats, DailyAverage, WeeklyAverage,
+                    MonthlyAverage, StoreAverage, AreaStat, GenreRanking, StoreRanking,
+                    AggregationWatermark, StoreDailyStats, StoreStatusCurrent)
 
 logger = logging.getLogger(__name__)
 
+# キャッシュ設定
+cache = None
+
+# キーにはDBから読んだ集計バージョンを含めるため、集計後は別プロセスのキャッシュでも古い値は読まれない
+# 次回の集計まで確実に残るよう集計間隔(1時間)より長くする
+AVERAGES_CACHE_TIMEOUT = 7200
+# 参照に失敗した場合に空の結果をキャッシュしておく秒数（障害時にDBへの再試行が集中するのを防ぐ）
+FAILED_FETCH_CACHE_TIMEOUT = 30
+
+def init_cache(cache_instance):
+    """キャッシュインスタンスを初期化"""
+    global cache
+    cache = cache_instance
+
+# 集計時刻の基準となる日本標準時
+JST = ZoneInfo('Asia/Tokyo')
+
+# 稼働率(%)の計算式。集計クエリはすべてこの式を共有する（working_staff が0の行はNULL）
+RATE_SQL = "(working_staff - active_staff) * 100.0 / NULLIF(working_staff, 0)"
+
+# (モデル, 列名の接頭辞, 集計期間(日), 最低サンプル数)
+AVERAGE_PERIODS = (
+    (DailyAverage, 'daily', 1, 1),
+    (WeeklyAverage, 'weekly', 7, 1),
+    (MonthlyAverage, 'monthly', 30, 1),
+    (StoreAverage, 'store', 730, 10),
+)
+
+# 期間ごとの集計列（条件付き集計で1回のスキャンから全期間を求める）
+PERIOD_AGG_COLUMNS = """
+       AVG(rate) FILTER (WHERE timestamp >= :{p}_cutoff) AS {p}_avg,
+       COUNT(*) FILTER (WHERE timestamp >= :{p}_cutoff) AS {p}_count,
+       MIN(timestamp) FILTER (WHERE timestamp >= :{p}_cutoff) AS {p}_start,
+       MAX(timestamp) FILTER (WHERE timestamp >= :{p}_cutoff) AS {p}_end"""
+
+# 最長期間(2年)の範囲を1回だけスキャンし、店舗ごとの集計結果を一時テーブルに保持する
+PERIOD_AGG_SQL = """
+CREATE TEMP TABLE period_agg AS
+SELECT store_name,
+       MAX(biz_type) AS biz_type,
+       MAX(genre) AS genre,
+       MAX(area) AS area,{columns}
+FROM (
+    SELECT store_name, timestamp, biz_type, genre, area,
+           {rate} AS rate
+    FROM store_status
+    WHERE working_staff > 0 AND timestamp >= :{widest}_cutoff
+)
+GROUP BY store_name
+""".format(
+    rate=RATE_SQL,
+    columns=','.join(PERIOD_AGG_COLUMNS.format(p=prefix) for _, prefix, _, _ in AVERAGE_PERIODS),
+    widest=max(AVERAGE_PERIODS, key=lambda period: period[2])[1]
+)
+
+# 期間別平均テーブルへの書き込み（GROUP BY の結果をPython側に戻さずDB内で完結させる）
+AVERAGE_INSERT_SQL = """
+INSERT INTO {table} (store_name, avg_rate, sample_count, start_date, end_date,
+                     biz_type, genre, area, updated_at)
+SELECT store_name, {p}_avg, {p}_count, {p}_start, {p}_end,
+       biz_type, genre, area, :now
+FROM period_agg
+WHERE {p}_count >= {min_count}
+"""
+
+# 再計算で使う文は起動時に1度だけ組み立てる
+# SQL文字列が毎回同一になるため、SQLAlchemyのコンパイル結果とドライバのステートメントキャッシュが再利用される
+PERIOD_AGG_STATEMENT = text(PERIOD_AGG_SQL)
+AVERAGE_REBUILD_STATEMENTS = tuple(
+    (
+        prefix,
+        text(f"DELETE FROM {model.__tablename__}"),
+        text(AVERAGE_INSERT_SQL.format(table=model.__tablename__, p=prefix, min_count=min_count)),
+    )
+    for model, prefix, _, min_count in AVERAGE_PERIODS
+)
+
+# ランキング系テーブルの再計算クエリ（APIのリクエストごとに集計しないよう、集計時に保存しておく）
+# 店舗ごとの最新行は store_status_current に保存し、後続のエリア別統計と /data がそれを参照する
+RANKING_REFRESH_SQL = (
+    (StoreStatusCurrent, """
+INSERT INTO store_status_current (id, timestamp, store_name, biz_type, genre, area,
+                                  total_staff, working_staff, active_staff, url, shift_time)
+WITH latest_data AS (
+    SELECT store_name, MAX(timestamp) as max_time
+    FROM store_status
+    GROUP BY store_name
+)
+SELECT s.id, s.timestamp, s.store_name, s.biz_type, s.genre, s.area,
+       s.total_staff, s.working_staff, s.active_staff, s.url, s.shift_time
+FROM store_status s
+JOIN latest_data l
+    ON s.store_name = l.store_name
+    AND s.timestamp = l.max_time
+"""),
+    (AreaStat, """
+INSERT INTO area_stats (area, store_count, avg_rate, updated_at)
+SELECT
+    area,
+    COUNT(DISTINCT store_name),
+    AVG(COALESCE({rate}, 0)),
+    :now
+FROM store_status_current
+GROUP BY area
+""".format(rate=RATE_SQL)),
+    (GenreRanking, """
+INSERT INTO genre_rankings (biz_type, genre, store_count, avg_rate, updated_at)
+WITH latest_data AS (
+    SELECT store_name, biz_type, MAX(timestamp) as max_time
+    FROM store_status
+    GROUP BY store_name, biz_type
+)
+SELECT
+    l.biz_type,
+    s.genre,
+    COUNT(DISTINCT s.store_name),
+    AVG(COALESCE({rate}, 0)),
+    :now
+FROM store_status s
+JOIN latest_data l
+    ON s.store_name = l.store_name
+    AND s.timestamp = l.max_time
+WHERE s.genre IS NOT NULL
+GROUP BY l.biz_type, s.genre
+""".format(rate=RATE_SQL)),
+    (StoreRanking, """
+INSERT INTO store_rankings (store_name, biz_type, genre, area, avg_rate, sample_count, updated_at)
+SELECT
+    store_name,
+    biz_type,
+    genre,
+    area,
+    AVG(COALESCE({rate}, 0)),
+    COUNT(*),
+    :now
+FROM store_status
+GROUP BY store_name, biz_type, genre, area
+HAVING COUNT(*) >= 5
+""".format(rate=RATE_SQL)),
+)
+RANKING_REBUILD_STATEMENTS = tuple(
+    (model.__tablename__, text(f"DELETE FROM {model.__tablename__}"), text(sql))
+    for model, sql in RANKING_REFRESH_SQL
+)
+
+# 日付・店舗別の稼働率合計の差分更新
+# 前回の集計以降に追加された行の最も古い日付から先だけを作り直す（日付は文字列の先頭10文字＝JST）
+# 日次・週次・月次の平均と店舗数はこのテーブルから求められる（式インデックス ix_store_status_day だけで集計できる）
+DAILY_SUMMARY_SINCE_STATEMENT = text("""
+SELECT MIN(substr(timestamp, 1, 10)) FROM store_status WHERE id > :last_id
+""")
+DAILY_SUMMARY_DELETE_STATEMENT = text("""
+DELETE FROM store_daily_stats WHERE date >= :since_day
+""")
+DAILY_SUMMARY_INSERT_STATEMENT = text("""
+INSERT INTO store_daily_stats (date, store_name, rate_sum, sample_count, updated_at)
+SELECT substr(timestamp, 1, 10),
+       store_name,
+       SUM(COALESCE({rate}, 0)),
+       COUNT(*),
+       :now
+FROM store_status
+WHERE substr(timestamp, 1, 10) >= :since_day
+GROUP BY substr(timestamp, 1, 10), store_name
+""".format(rate=RATE_SQL))
+
+# 期間別平均テーブルの参照クエリ
+AVERAGE_SELECT_SQL = """
+SELECT store_name, avg_rate, sample_count, start_date, end_date,
+       biz_type, genre, area, updated_at
+FROM {table}
+ORDER BY avg_rate DESC
+"""
+
+# 当日分の全体集計（タイムスタンプの範囲指定でインデックスを使う）
+DAILY_TOTALS_STATEMENT = text("""
+SELECT COUNT(id) AS record_count,
+       COUNT(DISTINCT store_name) AS store_count,
+       AVG(working_staff) AS avg_working_staff,
+       AVG(total_staff) AS avg_total_staff,
+       AVG(CASE WHEN total_staff > 0 AND shift_time != '' AND working_staff > 0
+           THEN working_staff * 100.0 / total_staff END) AS avg_operation_rate
+FROM store_status
+WHERE timestamp >= :day_start AND timestamp < :day_end
+""")
+
+# 日次統計テーブルの参照クエリ
+DAILY_STATS_SELECT_SQL = """
+SELECT date, record_count, store_count, avg_working_staff, avg_total_staff,
+       avg_operation_rate, last_updated
+FROM daily_stats
+ORDER BY date DESC
+"""
+
+# 参照系のステートメントは読み込み時に一度だけ組み立て、呼び出しごとの再構築を避ける
+SELECT_STATEMENTS = {
+    'daily': text(DAILY_STATS_SELECT_SQL),
+    'weekly': text(AVERAGE_SELECT_SQL.format(table=WeeklyAverage.__tablename__)),
+    'monthly': text(AVERAGE_SELECT_SQL.format(table=MonthlyAverage.__tablename__)),
+    'store': text(AVERAGE_SELECT_SQL.format(table=StoreAverage.__tablename__)),
+}
+LATEST_STATUS_ID_STATEMENT = text("SELECT MAX(id) FROM store_status")
+# 行の削除の検出用（現在の行数と、前回の集計以降に追加された行数）
+STATUS_COUNT_STATEMENT = text("SELECT COUNT(*) FROM store_status")
+NEW_STATUS_COUNT_STATEMENT = text("SELECT COUNT(*) FROM store_status WHERE id > :last_id")
+# 集計データのバージョン（集計のたびに更新される集計時刻）。参照用キャッシュキーに含めて一括で無効化する
+# SimpleCache はプロセスごとに別のため、バージョンはキャッシュではなくDBから読む
+AGG_VERSION_STATEMENT = text("SELECT updated_at FROM agg_watermark WHERE id = 1")
+
 class AggregatedData:
     """集計データを管理するクラス"""
 
     @staticmethod
-    def calculate_and_save_aggregated_data():
+    def calculate_and_save_aggregated_data(force=False):
         """
         スクレイピングデータから集計データを計算して保存する
+        前回の集計以降に新しい行がなく、force（既存行を更新した場合に指定）も偽なら何もせず None を返す
         """
         try:
             logger.info("集計データの計算を開始します")
 
+            # 削除と再挿入を1トランザクションにまとめ、コミット(fsync)を1回にする
+            # SQLiteではWALの読み取り中に書き込みロックへ昇格できず失敗しないよう、最初に書き込みロックを取る
+            if db.engine.dialect.name == 'sqlite':
+                db.session.connection().exec_driver_sql("BEGIN IMMEDIATE")
+
+            # 前回の集計以降に新しいデータも既存行の更新もなければ、全期間の再計算を行わない
+            # 既存行の UPDATE は MAX(id) に表れないため、更新したかどうかは呼び出し元が force で伝える
+            latest_id = db.session.execute(LATEST_STATUS_ID_STATEMENT).scalar() or 0
+            status_count = db.session.execute(STATUS_COUNT_STATEMENT).scalar() or 0
+            watermark = db.session.get(AggregationWatermark, 1)
+
+            # 前回の行数に追加分を足した数より少なければ、store_status の行が削除されている
+            # （IDは AUTOINCREMENT で再利用されないため、MAX(id) だけでは削除を検出できない）
+            rows_deleted = False
+            if watermark is not None:
+                new_count = db.session.execute(
+                    NEW_STATUS_COUNT_STATEMENT, {'last_id': watermark.last_status_id or 0}).scalar() or 0
+                rows_deleted = status_count < (watermark.status_count or 0) + new_count
+
+            if not force and not rows_deleted and watermark and watermark.last_status_id == latest_id:
+                logger.info("前回の集計以降に新しいデータがないため、集計をスキップします")
+                db.session.rollback()
+                return None
+
             # 最新の集計時刻を取得（JSTタイムゾーン）
-            jst = pytz.timezone('Asia/Tokyo')
-            current_time = datetime.now(jst)
+            current_time = datetime.now(JST)
 
             # 今日の日付（00:00:00）を取得
             today = current_time.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -43,65 +280,220 @@ class AggregatedData:
                 logger.info(f"本日 {today.strftime('%Y-%m-%d')} の集計データを新規作成します。")
                 daily = DailyStats(date=today)
 
-            # 今日のデータを集計
-            result = db.session.query(
-                func.count(StoreStatus.id).label('record_count'),
-                func.count(func.distinct(StoreStatus.store_name)).label('store_count'),
-                func.avg(StoreStatus.working_staff).label('avg_working_staff'),
-                func.avg(StoreStatus.total_staff).label('avg_total_staff'),
-                func.avg(
-                    func.case(
-                        [(and_(
-                            StoreStatus.total_staff > 0,
-                            StoreStatus.shift_time != '',  # シフト時間が設定されている
-                            StoreStatus.working_staff > 0  # 勤務中のスタッフがいる
-                        ), 
-                        StoreStatus.working_staff * 100.0 / StoreStatus.total_staff)],
-                        else_=None
-                    )
-                ).label('avg_operation_rate')
-            ).filter(
-                func.date(StoreStatus.timestamp) == func.date(today)
-            ).first()
+            # 今日のデータを集計（行は辞書として受け取り、属性アクセスを介さない）
+            day_start = today.replace(tzinfo=None)
+            result = db.session.execute(DAILY_TOTALS_STATEMENT, {
+                'day_start': day_start.isoformat(),
+                'day_end': (day_start + timedelta(days=1)).isoformat()
+            }).mappings().first()
 
             if result:
-                daily.record_count = result.record_count or 0
-                daily.store_count = result.store_count or 0
-                daily.avg_working_staff = float(result.avg_working_staff or 0)
-                daily.avg_total_staff = float(result.avg_total_staff or 0)
-                daily.avg_operation_rate = float(result.avg_operation_rate or 0)
+                daily.record_count = result['record_count'] or 0
+                daily.store_count = result['store_count'] or 0
+                daily.avg_working_staff = float(result['avg_working_staff'] or 0)
+                daily.avg_total_staff = float(result['avg_total_staff'] or 0)
+                daily.avg_operation_rate = float(result['avg_operation_rate'] or 0)
                 daily.last_updated = current_time
 
                 db.session.add(daily)
-                db.session.commit()
 
-                logger.info(f"集計データを保存しました: 対象店舗数={daily.store_count}, 平均稼働率={daily.avg_operation_rate:.2f}%")
+                logger.info(f"集計データを更新しました: 対象店舗数={daily.store_count}, 平均稼働率={daily.avg_operation_rate:.2f}%")
             else:
                 logger.warning("今日のデータが見つかりませんでした。集計をスキップします。")
 
+            counts = AggregatedData._refresh_average_tables(current_time)
+            AggregatedData._refresh_ranking_tables(current_time)
+            # 未集計の場合と store_status の行が削除されている場合は、全期間を作り直す
+            if watermark is None or rows_deleted:
+                last_status_id = None
+            else:
+                last_status_id = watermark.last_status_id
+            AggregatedData._refresh_daily_summary(current_time, last_status_id)
+
+            if watermark is None:
+                watermark = AggregationWatermark(id=1)
+                db.session.add(watermark)
+            watermark.last_status_id = latest_id
+            watermark.status_count = status_count
+            watermark.updated_at = current_time
+
+            db.session.commit()
+            AggregatedData._refresh_planner_stats()
+            return counts
+
         except Exception as e:
             logger.error(f"集計データの計算中にエラーが発生しました: {e}")
             db.session.rollback()
 
+    @staticmethod
+    def _refresh_average_tables(current_time):
+        """
+        日次・週次・月次・店舗別の平均テーブルを再計算する
+        store_status のスキャンは1回だけで、各テーブルは一時テーブルからの INSERT ... SELECT で作り直す
+        """
+        # store_status のタイムスタンプはISO形式の文字列で保存されているため同じ形式で比較する
+        now = current_time.replace(tzinfo=None)
+        params = {
+            f'{prefix}_cutoff': (now - timedelta(days=days)).isoformat()
+            for _, prefix, days, _ in AVERAGE_PERIODS
+        }
+        counts = {}
+
+        db.session.execute(text("DROP TABLE IF EXISTS temp.period_agg"))
+        db.session.execute(PERIOD_AGG_STATEMENT, params)
+
+        # コミットは呼び出し元でまとめて行う
+        for prefix, delete_statement, insert_statement in AVERAGE_REBUILD_STATEMENTS:
+            # 全件作り直しのため、ORMのセッション同期を伴わない素のDELETEで消す
+            db.session.execute(delete_statement)
+            result = db.session.execute(insert_statement, {'now': now})
+            counts[f'{prefix}_count'] = result.rowcount
+
+        db.session.execute(text("DROP TABLE temp.period_agg"))
+
+        logger.info(f"期間別平均データを更新しました: {counts}")
+        return counts
+
+    @staticmethod
+    def _refresh_ranking_tables(current_time):
+        """エリア別統計・ジャンル別ランキング・店舗別ランキングのテーブルを再計算する"""
+        now = current_time.replace(tzinfo=None)
+        counts = {}
+
+        # コミットは呼び出し元でまとめて行う
+        for table, delete_statement, insert_statement in RANKING_REBUILD_STATEMENTS:
+            db.session.execute(delete_statement)
+            result = db.session.execute(insert_statement, {'now': now})
+            counts[table] = result.rowcount
+
+        logger.info(f"ランキングデータを更新しました: {counts}")
+        return counts
+
+    @staticmethod
+    def _refresh_daily_summary(current_time, last_status_id):
+        """
+        日付・店舗別の稼働率合計を、前回の集計以降にデータが増えた日の分だけ作り直す
+        last_status_id が None の場合（未集計・行の削除あり）は全期間を作り直す
+        """
+        now = current_time.replace(tzinfo=None)
+
+        if last_status_id is None or db.session.query(StoreDailyStats.date).first() is None:
+            # 初回・削除後は全期間を作る
+            since_day = ''
+        else:
+            since_day = db.session.execute(
+                DAILY_SUMMARY_SINCE_STATEMENT, {'last_id': last_status_id}).scalar()
+            # 既存行の更新は当日分に対して行われるため、当日は必ず作り直す
+            today = now.date().isoformat()
+            since_day = min(since_day, today) if since_day else today
+
+        # コミットは呼び出し元でまとめて行う
+        db.session.execute(DAILY_SUMMARY_DELETE_STATEMENT, {'since_day': since_day})
+        result = db.session.execute(DAILY_SUMMARY_INSERT_STATEMENT, {'since_day': since_day, 'now': now})
+
+        logger.info(f"日付・店舗別稼働率を更新しました: {since_day or '全期間'}以降 {result.rowcount}件")
+        return result.rowcount
+
+    @staticmethod
+    def _fetch_mappings(statement):
+        """ORMオブジェクトを生成せず、結果を辞書のリストで返す"""
+        return [dict(row) for row in db.session.execute(statement).mappings()]
+
+    @staticmethod
+    def _refresh_planner_stats():
+        """全件作り直した集計テーブルの統計情報を更新する（SQLiteのみ）"""
+        if db.engine.dialect.name != 'sqlite':
+            return
+        try:
+            tables = [model.__tablename__ for model, _, _, _ in AVERAGE_PERIODS]
+            tables += [model.__tablename__ for model, _ in RANKING_REFRESH_SQL]
+            for table in tables:
+                db.session.execute(text(f"ANALYZE {table}"))
+            db.session.execute(text("PRAGMA analysis_limit = 400"))
+            db.session.execute(text("PRAGMA optimize"))
+            db.session.commit()
+        except Exception as e:
+            logger.error(f"統計情報の更新中にエラーが発生しました: {e}")
+            db.session.rollback()
+
+    @staticmethod
+    def _cached_fetch(name):
+        """
+        集計バージョン付きのキーで参照結果をキャッシュする
+        バージョンはDBの集計時刻のため、集計したプロセスとキャッシュを共有していなくても古い値は読まれない
+        キャッシュミス時はロックを取得したワーカーだけがDBを参照する
+        値はpickleではなくorjsonでシリアライズしたバイト列として保存する
+        """
+        statement = SELECT_STATEMENTS[name]
+        if cache is None:
+            return AggregatedData._fetch_mappings(statement)
+
+        version = db.session.execute(AGG_VERSION_STATEMENT).scalar()
+        if version is None:
+            # まだ一度も集計していない間の結果（空の集計テーブルから作った結果）はキャッシュしない
+            return AggregatedData._fetch_mappings(statement)
+
+        cache_key = f"{name}:{version}"
+        payload = cache.get(cache_key)
+        if payload is not None:
+            return orjson.loads(payload)
+
+        lock_key = f"lock:{cache_key}"
+        locked = cache.add(lock_key, 1, timeout=30)
+        if not locked:
+            # 他のワーカーが計算中のため、少し待ってからキャッシュを再確認する
+            time.sleep(0.2)
+            payload = cache.get(cache_key)
+            if payload is not None:
+                return orjson.loads(payload)
+
+        try:
+            data = AggregatedData._fetch_mappings(statement)
+            cache.set(cache_key, orjson.dumps(data), timeout=AVERAGES_CACHE_TIMEOUT)
+        except Exception as e:
+            logger.error(f"{name} の参照中にエラーが発生しました: {e}")
+            db.session.rollback()
+            # 短時間だけ空の結果をキャッシュし、他のワーカーが同じ失敗を繰り返さないようにする
+            data = []
+            cache.set(cache_key, orjson.dumps(data), timeout=FAILED_FETCH_CACHE_TIMEOUT)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return data
+
     @staticmethod
     def get_daily_averages():
         """日次平均データの取得"""
-        return DailyStats.query.order_by(DailyStats.date.desc()).all()
+        return AggregatedData._cached_fetch('daily')
 
     @staticmethod
     def get_weekly_averages():
-        """週次平均データの取得 (実装が必要)"""
-        return [] # Placeholder - needs implementation
+        """週次平均データの取得"""
+        return AggregatedData._cached_fetch('weekly')
 
     @staticmethod
     def get_monthly_averages():
-        """月次平均データの取得 (実装が必要)"""
-        return [] # Placeholder - needs implementation
+        """月次平均データの取得"""
+        return AggregatedData._cached_fetch('monthly')
 
     @staticmethod
     def get_store_averages():
-        """店舗全期間平均データの取得 (実装が必要)"""
-        return [] # Placeholder - needs implementation
+        """店舗全期間平均データの取得"""
+        return AggregatedData._cached_fetch('store')
+
+    @staticmethod
+    def warm_cache():
+        """
+        集計後に参照用キャッシュを作っておき、リクエスト時の再計算を避ける
+        Webプロセスとキャッシュを共有している場合（Redis）にだけ意味がある
+        """
+        if cache is None:
+            return
+        AggregatedData.get_daily_averages()
+        AggregatedData.get_weekly_averages()
+        AggregatedData.get_monthly_averages()
+        AggregatedData.get_store_averages()
+        logger.info("参照用キャッシュを作成しました")
 
 # Remove the placeholder class
 #class AggregatedStat:
@@ -1,12 +1,16 @@
 import os
 import logging
-import json
-from datetime import datetime, timedelta
-from functools import wraps
+import hashlib
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone, time as dt_time
+from functools import lru_cache, wraps
 from typing import Dict, List, Union, Optional, Any, Tuple
-import pytz
 
-from flask import Blueprint, request, jsonify, current_app, send_file
+import orjson
+from flask import Blueprint, Response, request, current_app, send_file, stream_with_context
 from flask_caching import Cache
 
 from models import db, StoreStatus
@@ -23,8 +27,25 @@ def init_cache(cache_instance):
 # APIロガーの設定
 logger = logging.getLogger('api')
 
-# レートリミット用の簡易キャッシュ（本番環境ではRedisなどに置き換え）
-rate_limit_cache = {}
+# レートリミット用の簡易キャッシュ（共有キャッシュが使えない場合のプロセス内カウンタ）
+# クライアントごとに [リクエスト数, リセット時刻(monotonic秒)] を持ち、上限を超えたら最も古く使われたものから捨てる
+RATE_LIMIT_CACHE_MAX_ENTRIES = 10000
+rate_limit_cache = OrderedDict()
+rate_limit_lock = threading.Lock()
+# 共有キャッシュでのカウントに失敗したことを記録済みか（リクエストごとにログを出さないため）
+rate_limit_cache_error_logged = False
+
+# 店舗名一覧をプロセス内に保持する時間の刻み（秒）。スクレイピングは別プロセスで動くため、
+# 新しい店舗が一覧に現れるまでの遅れはこの刻みで決まる
+STORE_NAMES_TICK_SECONDS = 600
+
+@lru_cache(maxsize=4)
+def _store_names(tick):
+    """店舗名の一覧（tick が変わるまでプロセス内で使い回す）"""
+    conn = get_db_connection()
+    return tuple(name for (name,) in conn.execute(
+        "SELECT DISTINCT store_name FROM store_status ORDER BY store_name"
+    ))
 
 # キャッシュデコレーター関数
 def cached(timeout=300, key_prefix='view/%s'):
@@ -36,22 +57,36 @@ def cached(timeout=300, key_prefix='view/%s'):
                 # キャッシュが設定されていない場合は通常通り実行
                 return f(*args, **kwargs)
 
-            cache_key = key_prefix % request.path
+            # URLではなくエンドポイント名でキーを作り、同じビューに別名のURLがあってもキャッシュを共有する
+            cache_key = key_prefix % request.endpoint
 
-            # クエリパラメータがある場合はキャッシュキーに追加
-            if request.query_string:
-                cache_key = f"{cache_key}?{request.query_string.decode('utf-8')}"
+            # URL変数・クエリパラメータがある場合はキャッシュキーに追加（長さを一定にするためハッシュ化する）
+            # 並び順だけが違うクエリを同じキーにするため、パラメータは整列してから使う
+            view_args = request.view_args
+            if view_args or request.query_string:
+                # ビュー関数に渡す *args を上書きしないよう、キーの材料は別名で持つ
+                key_material = orjson.dumps([sorted((view_args or {}).items()),
+                                             sorted(request.args.items(multi=True))])
+                cache_key = f"{cache_key}?{hashlib.blake2b(key_material, digest_size=16).hexdigest()}"
 
-            # キャッシュから取得
+            # キャッシュから取得（本文は圧縮して保存しているため、応答オブジェクトを作り直す）
             cached_response = cache.get(cache_key)
             if cached_response is not None:
-                return cached_response
+                body, status, mimetype, etag = cached_response
+                response = Response(zlib.decompress(body), status=status, mimetype=mimetype)
+                if etag:
+                    response.set_etag(etag)
+                    response.make_conditional(request)
+                return response
 
             # 関数を実行してレスポンスを生成
-            response = f(*args, **kwargs)
+            response = current_app.make_response(f(*args, **kwargs))
 
-            # レスポンスをキャッシュに保存
-            cache.set(cache_key, response, timeout=timeout)
+            # 正常な応答だけを保存する（If-None-Match による304はそのリクエスト固有のため保存しない）
+            if response.status_code == 200:
+                etag, _ = response.get_etag()
+                cache.set(cache_key, (zlib.compress(response.get_data(), 1), response.status_code,
+                                      response.mimetype, etag), timeout=timeout)
 
             return response
         return decorated_function
@@ -63,35 +98,72 @@ def rate_limit(limit=60, per=60, by_ip=True):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            now = datetime.now()
+            global rate_limit_cache_error_logged
 
             # クライアントの識別子
             client_id = request.remote_addr if by_ip else 'global'
 
-            # レートリミット情報の取得または初期化
-            if client_id not in rate_limit_cache:
-                rate_limit_cache[client_id] = {
-                    'count': 0,
-                    'reset_at': now + timedelta(seconds=per)
-                }
-
-            # 制限時間が経過していれば、カウンタをリセット
-            if now >= rate_limit_cache[client_id]['reset_at']:
-                rate_limit_cache[client_id]['count'] = 0
-                rate_limit_cache[client_id]['reset_at'] = now + timedelta(seconds=per)
-
-            # リクエスト数のカウントアップ
-            rate_limit_cache[client_id]['count'] += 1
+            # 共有キャッシュ（Redis）があれば、時間枠ごとのキーで全ワーカー共通に数える
+            # add はキーが無いときだけ有効期限付きで作成し、inc は Redis では INCR で原子的に加算される
+            # inc は flask_caching の Cache には無いため、バックエンド（cache.cache）を直接使う
+            if cache is not None:
+                count = None
+                try:
+                    backend = cache.cache
+                    window_key = f"rate_limit:{client_id}:{int(time.time() // per)}"
+                    backend.add(window_key, 0, timeout=per)
+                    count = backend.inc(window_key)
+                except Exception as e:
+                    if not rate_limit_cache_error_logged:
+                        rate_limit_cache_error_logged = True
+                        logger.warning(f"共有キャッシュでのレートリミットに失敗したため、プロセス内のカウンタを使います: {e}")
+                # ビュー関数の例外でカウンタを二重に数えないよう、呼び出しは try の外で行う
+                if count is not None:
+                    if count > limit:
+                        return json_response({'error': 'Rate limit exceeded'}, 429)
+                    return f(*args, **kwargs)
+
+            # 経過時間の判定だけなので、日時オブジェクトを作らず単調増加する秒数で比べる
+            now = time.monotonic()
+
+            with rate_limit_lock:
+                # レートリミット情報の取得（制限時間が経過していれば、カウンタをリセット）
+                bucket = rate_limit_cache.get(client_id)
+                if bucket is None:
+                    bucket = rate_limit_cache[client_id] = [0, now + per]
+                elif now >= bucket[1]:
+                    bucket[0], bucket[1] = 0, now + per
+
+                # リクエスト数のカウントアップ（リストをその場で更新する）
+                bucket[0] += 1
+                count = bucket[0]
+
+                # 最近使われた順に並べ、上限を超えた分は最も古いものから捨てる（期限切れの枠から消える）
+                rate_limit_cache.move_to_end(client_id)
+                if len(rate_limit_cache) > RATE_LIMIT_CACHE_MAX_ENTRIES:
+                    rate_limit_cache.popitem(last=False)
 
             # 制限を超えたかチェック
-            if rate_limit_cache[client_id]['count'] > limit:
-                return jsonify({'error': 'Rate limit exceeded'}), 429
+            if count > limit:
+                return json_response({'error': 'Rate limit exceeded'}, 429)
 
             return f(*args, **kwargs)
         return decorated_function
     return decorator
 
 # レスポンス用のヘルパー関数
+def json_response(payload: Any, status: int = 200) -> Response:
+    """
+    orjsonでシリアライズしたJSONレスポンスを返す（datetimeはそのまま渡せる）
+    成功時は内容のETagを付け、If-None-Match が一致すれば本文なしの304を返す
+    """
+    body = orjson.dumps(payload)
+    response = Response(body, status=status, mimetype='application/json')
+    if status == 200:
+        response.set_etag(hashlib.blake2b(body, digest_size=16).hexdigest())
+        response.make_conditional(request)
+    return response
+
 def api_response(data: Any, status: int = 200, message: str = 'success') -> Tuple[Dict, int]:
     """API応答の標準形式"""
     response_data = {
@@ -99,43 +171,55 @@ def api_response(data: Any, status: int = 200, message: str = 'success') -> Tupl
         'data': data
     }
 
+    response = json_response(response_data, status)
+
     # デバッグログ - レスポンスの構造を出力
     if logger.isEnabledFor(logging.DEBUG):
-        import json
-        logger.debug(f"API応答: {json.dumps(response_data, ensure_ascii=False, default=str)[:200]}...")
+        logger.debug(f"API応答: {response.get_data(as_text=True)[:200]}...")
 
-    response = jsonify(response_data)
-    response.headers['Content-Type'] = 'application/json'
-    return response, status
+    # ETagが一致した場合は304になっているため、レスポンス側のステータスを返す
+    return response, response.status_code
 
 def error_response(message: str, status: int = 400) -> Tuple[Dict, int]:
     """エラー応答の標準形式"""
-    response = jsonify({
+    return json_response({
         'status': 'error',
         'message': message
-    })
-    response.headers['Content-Type'] = 'application/json'
-    return response, status
+    }, status), status
+
+# 期間指定の履歴をストリーミングで返すときに1回でシリアライズする行数
+HISTORY_STREAM_BATCH_SIZE = 1000
+
+# ヘルスチェックの応答本文（api_response と同じ形式。変わるのは時刻だけなので事前に組み立てておく）
+_HEALTH_BODY_TEMPLATE = b'{"status":"success","data":{"status":"ok","timestamp":"%s","version":"1.0"}}'
 
 # グローバルヘルスチェックエンドポイント（Blueprintの外側）
 def register_health_check(app):
     @app.route('/api/v1/health')
-    @cached(timeout=10)
     def health_check():
         """APIの健康状態を確認するエンドポイント"""
-        return api_response({
-            'status': 'ok',
-            'timestamp': datetime.now().isoformat(),
-            'version': '1.0'
-        })
+        # 監視から頻繁に呼ばれるため、辞書の生成やキャッシュ参照をせずに本文を埋めるだけにする
+        body = _HEALTH_BODY_TEMPLATE % datetime.now().isoformat().encode()
+        return Response(body, mimetype='application/json')
 
 
-from flask import request, jsonify
+from flask import request
 from datetime import datetime, timedelta
-import pytz
 from models import db, StoreStatus
 from database import get_db_connection
 
+# 各店舗の最新行（集計前で store_status_current がまだ空の場合に使う）
+LATEST_STORE_STATUS_SQL = """(
+                SELECT s.* FROM store_status s
+                JOIN (
+                    SELECT store_name, MAX(timestamp) as max_timestamp
+                    FROM store_status
+                    GROUP BY store_name
+                ) lt
+                    ON s.store_name = lt.store_name
+                    AND s.timestamp = lt.max_timestamp
+            )"""
+
 def register_api_routes(bp):
     """シンプル化したAPIエンドポイント"""
 
@@ -144,12 +228,9 @@ def register_api_routes(bp):
         """現在の店舗データを取得"""
         try:
             conn = get_db_connection()
+            # 集計処理で保存済みの各店舗の最新行を参照する
+            # 未集計（テーブルが空）の場合だけ store_status から最新行を求める
             query = """
-            WITH latest_timestamps AS (
-                SELECT store_name, MAX(timestamp) as max_timestamp
-                FROM store_status
-                GROUP BY store_name
-            )
             SELECT 
                 s.store_name,
                 s.biz_type,
@@ -159,56 +240,38 @@ def register_api_routes(bp):
                 s.working_staff,
                 s.active_staff,
                 s.timestamp,
-                s.url
-            FROM store_status s
-            JOIN latest_timestamps lt 
-                ON s.store_name = lt.store_name 
-                AND s.timestamp = lt.max_timestamp
-            WHERE s.store_name IS NOT NULL
-            AND s.area IS NOT NULL
+                ROUND(CASE WHEN s.working_staff > 0
+                    THEN (s.working_staff - s.active_staff) * 100.0 / s.working_staff
+                    ELSE 0 END, 1) AS rate
+            FROM {source} s
+            WHERE s.store_name != ''
+            AND s.area != ''
             """
-            results = conn.execute(query).fetchall()
+            cursor = conn.execute(query.format(source='store_status_current'))
+            results = cursor.fetchall()
+            if not results:
+                cursor = conn.execute(query.format(source=LATEST_STORE_STATUS_SQL))
+                results = cursor.fetchall()
 
             if not results:
-                return jsonify({
+                return json_response({
                     'status': 'error',
                     'message': 'データが見つかりません',
                     'error_code': 'NO_DATA',
                     'data': []
-                }), 404
-
-            stores = []
-            for r in results:
-                r_dict = dict(r)
-                if not r_dict.get('store_name') or not r_dict.get('area'):
-                    continue
-
-                working_staff = int(r_dict.get('working_staff', 0))
-                active_staff = int(r_dict.get('active_staff', 0))
-                total_staff = int(r_dict.get('total_staff', 0))
-
-                rate = 0
-                if working_staff > 0:
-                    rate = round(((working_staff - active_staff) / working_staff) * 100, 1)
-
-                store = {
-                    'store_name': r_dict['store_name'],
-                    'biz_type': r_dict.get('biz_type', ''),
-                    'genre': r_dict.get('genre', ''),
-                    'area': r_dict['area'],
-                    'total_staff': total_staff,
-                    'working_staff': working_staff,
-                    'active_staff': active_staff,
-                    'timestamp': r_dict['timestamp'].isoformat() if r_dict.get('timestamp') else None,
-                    'rate': rate
-                }
-                stores.append(store)
+                }, 404)
 
-            return jsonify({
+            # 空の店舗名・エリアの除外と稼働率の計算はSQL側で済ませている
+            # SELECT句の列名がそのままレスポンスのキーになるため、列名は一度だけ取り出して位置で対応付ける
+            columns = [d[0] for d in cursor.description]
+            stores = [dict(zip(columns, r)) for r in results]
+
+            # 店舗名などの日本語が多いため、エスケープせずに出力するorjsonで返す（datetimeもそのまま渡せる）
+            return json_response({
                 'status': 'success',
                 'data': {
                     'meta': {
-                        'last_updated': datetime.now(pytz.UTC).isoformat(),
+                        'last_updated': datetime.now(timezone.utc),
                         'total_count': len(stores)
                     },
                     'stores': stores
@@ -216,11 +279,11 @@ def register_api_routes(bp):
             })
         except Exception as e:
             logger.error(f"APIエラー: {str(e)}")
-            return jsonify({
+            return json_response({
                 'status': 'error',
                 'message': 'データの取得に失敗しました',
                 'data': None
-            }), 500
+            }, 500)
 
     @bp.route('/history')
     def get_store_history():
@@ -229,38 +292,39 @@ def register_api_routes(bp):
             store = request.args.get('store')
             conn = get_db_connection()
 
+            # 応答に使う列だけを取得し、NULLの補完もSQL側で行う（行はそのまま辞書に変換する）
+            columns = """
+                store_name, timestamp,
+                CAST(COALESCE(working_staff, 0) AS INTEGER) AS working_staff,
+                CAST(COALESCE(active_staff, 0) AS INTEGER) AS active_staff
+            """
             if store:
-                query = """
-                SELECT * FROM store_status 
+                query = f"""
+                SELECT {columns} FROM store_status 
                 WHERE store_name = ?
                 ORDER BY timestamp DESC
                 LIMIT 500
                 """
-                results = conn.execute(query, [store]).fetchall()
+                results = conn.execute(query, [store])
             else:
-                query = """
-                SELECT * FROM store_status 
+                query = f"""
+                SELECT {columns} FROM store_status 
                 ORDER BY timestamp DESC
                 LIMIT 500
                 """
-                results = conn.execute(query).fetchall()
+                results = conn.execute(query)
 
-            history = [{
-                'store_name': r['store_name'],
-                'timestamp': r['timestamp'],
-                'working_staff': int(r['working_staff'] or 0),
-                'active_staff': int(r['active_staff'] or 0)
-            } for r in results]
+            history = [dict(r) for r in results]
 
-            return jsonify({
+            return json_response({
                 'status': 'success',
                 'data': history
             })
         except Exception as e:
-            return jsonify({
+            return json_response({
                 'status': 'error',
                 'message': str(e)
-            }), 500
+            }, 500)
 
 
     @bp.route('/history/optimized')
@@ -272,23 +336,21 @@ def register_api_routes(bp):
             store = request.args.get('store', '')
 
             if not all([start_date, end_date]):
-                return jsonify({
+                return json_response({
                     'status': 'error',
                     'message': '開始日と終了日を指定してください',
                     'data': []
-                }), 400
+                }, 400)
 
             try:
                 # 現在時刻を取得してデフォルトの検索期間を設定
-                now = datetime.now(pytz.UTC)
+                now = datetime.now(timezone.utc)
 
                 # 指定された日付があればそれを使用
                 if start_date and end_date:
-                    # naiveなdatetimeを作成してUTCに変換
-                    start = datetime.strptime(f"{start_date} 00:00:00", '%Y-%m-%d %H:%M:%S')
-                    end = datetime.strptime(f"{end_date} 23:59:59", '%Y-%m-%d %H:%M:%S')
-                    start = start.replace(tzinfo=pytz.UTC)
-                    end = end.replace(tzinfo=pytz.UTC)
+                    # 日付は fromisoformat（C実装）で解析し、その日の始まりと終わりのUTC時刻にする
+                    start = datetime.combine(date.fromisoformat(start_date), dt_time.min, tzinfo=timezone.utc)
+                    end = datetime.combine(date.fromisoformat(end_date), dt_time(23, 59, 59), tzinfo=timezone.utc)
 
                     # 2025年のデータなので未来の日付チェックは不要
                 else:
@@ -302,23 +364,20 @@ def register_api_routes(bp):
 
             except ValueError as e:
                 logger.error(f"日付変換エラー: {e}")
-                return jsonify({
+                return json_response({
                     'status': 'error',
                     'message': '日付形式が無効です（YYYY-MM-DD）',
                     'data': []
-                }), 400
+                }, 400)
 
             conn = get_db_connection()
             query = """
             SELECT 
                 store_name,
                 timestamp,
-                working_staff,
-                active_staff,
-                total_staff,
-                biz_type,
-                genre,
-                area
+                CAST(COALESCE(working_staff, 0) AS INTEGER) AS working_staff,
+                CAST(COALESCE(active_staff, 0) AS INTEGER) AS active_staff,
+                CAST(COALESCE(total_staff, 0) AS INTEGER) AS total_staff
             FROM store_status 
             WHERE timestamp BETWEEN ? AND ?
             """
@@ -329,75 +388,62 @@ def register_api_routes(bp):
                 params.append(store)
 
             query += " ORDER BY timestamp"
-            results = conn.execute(query, params).fetchall()
-
-            history = [{
-                'store_name': r['store_name'],
-                'timestamp': r['timestamp'].isoformat() if r['timestamp'] else None,
-                'working_staff': int(r['working_staff'] or 0),
-                'active_staff': int(r['active_staff'] or 0),
-                'total_staff': int(r['total_staff'] or 0)
-            } for r in results]
-
-            return jsonify({
-                'status': 'success',
-                'data': history
-            })
+            # クエリの失敗は通常のエラー応答にするため、実行だけは先に済ませておく
+            results = conn.execute(query, params)
+
+            def generate():
+                """期間指定は件数の上限がないため、全行を保持せずカーソルから一定件数ずつJSONにして送る"""
+                yield b'{"status":"success","data":['
+                first = True
+                while True:
+                    rows = results.fetchmany(HISTORY_STREAM_BATCH_SIZE)
+                    if not rows:
+                        break
+                    # NULLの補完と整数化はSQL側で済ませているため、行はそのまま辞書に変換する
+                    chunk = orjson.dumps([dict(r) for r in rows])
+                    if not first:
+                        yield b','
+                    first = False
+                    # リストの括弧を外して配列の要素として連結する
+                    yield chunk[1:-1]
+                yield b']}'
+
+            return Response(stream_with_context(generate()), mimetype='application/json')
 
         except Exception as e:
             logger.error(f"履歴データ取得エラー: {str(e)}")
-            return jsonify({
+            return json_response({
                 'status': 'error',
                 'message': str(e)
-            }), 500
+            }, 500)
 
     @bp.route('/store-names')
     def get_store_names():
         """店舗名の一覧を取得"""
         try:
-            conn = get_db_connection()
-            results = conn.execute(
-                "SELECT DISTINCT store_name FROM store_status ORDER BY store_name"
-            ).fetchall()
-            names = [r['store_name'] for r in results]
-            return jsonify({'status': 'success', 'data': names})
+            # 店舗名はほとんど変わらないため、一定時間ごとの刻みでプロセス内にメモ化する
+            names = _store_names(int(time.monotonic() // STORE_NAMES_TICK_SECONDS))
+            return json_response({'status': 'success', 'data': list(names)})
         except Exception as e:
-            return jsonify({'status': 'error', 'message': str(e)}), 500
+            return json_response({'status': 'error', 'message': str(e)}, 500)
 
     @bp.route('/area-stats')
     def get_area_stats():
         """エリア別の統計を取得"""
         try:
             conn = get_db_connection()
+            # 集計処理で保存済みのエリア別統計を参照する
             query = """
-            WITH latest_data AS (
-                SELECT store_name, MAX(timestamp) as max_time
-                FROM store_status
-                GROUP BY store_name
-            )
-            SELECT 
-                area,
-                COUNT(DISTINCT s.store_name) as store_count,
-                AVG(CASE WHEN s.working_staff > 0 
-                    THEN CAST((s.working_staff - s.active_staff) AS FLOAT) / s.working_staff * 100 
-                    ELSE 0 END) as avg_rate
-            FROM store_status s
-            JOIN latest_data l 
-                ON s.store_name = l.store_name 
-                AND s.timestamp = l.max_time
-            GROUP BY area
+            SELECT area, store_count, ROUND(avg_rate, 1) AS avg_rate
+            FROM area_stats
             ORDER BY store_count DESC
             """
-            results = conn.execute(query).fetchall()
-            stats = [{
-                'area': r['area'],
-                'store_count': r['store_count'],
-                'avg_rate': round(r['avg_rate'], 1)
-            } for r in results]
-
-            return jsonify({'status': 'success', 'data': stats})
+            # 丸めはSQL側で行い、行はそのまま辞書に変換する
+            stats = [dict(r) for r in conn.execute(query)]
+
+            return json_response({'status': 'success', 'data': stats})
         except Exception as e:
-            return jsonify({'status': 'error', 'message': str(e)}), 500
+            return json_response({'status': 'error', 'message': str(e)}, 500)
 
     @bp.route('/ranking/genre')
     def get_genre_ranking():
@@ -406,38 +452,19 @@ def register_api_routes(bp):
             biz_type = request.args.get('biz_type')
             conn = get_db_connection()
 
+            # 集計処理で保存済みのジャンル別統計を参照する
             query = """
-            WITH latest_data AS (
-                SELECT store_name, MAX(timestamp) as max_time
-                FROM store_status
-                WHERE biz_type = ?
-                GROUP BY store_name
-            )
-            SELECT 
-                genre,
-                COUNT(DISTINCT s.store_name) as store_count,
-                AVG(CASE WHEN s.working_staff > 0 
-                    THEN CAST((s.working_staff - s.active_staff) AS FLOAT) / s.working_staff * 100 
-                    ELSE 0 END) as avg_rate
-            FROM store_status s
-            JOIN latest_data l 
-                ON s.store_name = l.store_name 
-                AND s.timestamp = l.max_time
-            GROUP BY genre
-            HAVING genre IS NOT NULL
-            ORDER BY avg_rate DESC
+            SELECT genre, store_count, ROUND(avg_rate, 1) AS avg_rate
+            FROM genre_rankings
+            WHERE biz_type = ?
+            ORDER BY genre_rankings.avg_rate DESC
             """
-            results = conn.execute(query, [biz_type]).fetchall()
+            # 丸めはSQL側で行い、行はそのまま辞書に変換する
+            data = [dict(r) for r in conn.execute(query, [biz_type])]
 
-            data = [{
-                'genre': r['genre'],
-                'store_count': r['store_count'],
-                'avg_rate': round(r['avg_rate'], 1)
-            } for r in results]
-
-            return jsonify({'status': 'success', 'data': data})
+            return json_response({'status': 'success', 'data': data})
         except Exception as e:
-            return jsonify({'status': 'error', 'message': str(e)}), 500
+            return json_response({'status': 'error', 'message': str(e)}, 500)
 
     @bp.route('/averages/weekly')
     def get_weekly_averages():
@@ -445,95 +472,76 @@ def register_api_routes(bp):
         try:
             conn = get_db_connection()
             limit = request.args.get('limit', default=20, type=int)
+            # 集計処理で差分更新している日付・店舗別の合計から週ごとの稼働率を求める
+            # （週は JST の日付から求め、合計÷件数で日ごとの件数の違いを重み付けする）
             query = """
             WITH weekly_data AS (
                 SELECT 
                     store_name,
-                    strftime('%Y-%W', timestamp) as week,
-                    AVG(CASE WHEN working_staff > 0 
-                        THEN CAST((working_staff - active_staff) AS FLOAT) / working_staff * 100 
-                        ELSE 0 END) as weekly_rate
-                FROM store_status
+                    strftime('%Y-%W', date) as week,
+                    SUM(rate_sum) / SUM(sample_count) as weekly_rate
+                FROM store_daily_stats
                 GROUP BY store_name, week
                 HAVING week IS NOT NULL
             )
             SELECT 
                 store_name,
-                AVG(weekly_rate) as avg_rate,
+                ROUND(AVG(weekly_rate), 1) as avg_rate,
                 COUNT(DISTINCT week) as weeks_count
             FROM weekly_data
             GROUP BY store_name
             HAVING weeks_count >= 1
-            ORDER BY avg_rate DESC
+            ORDER BY AVG(weekly_rate) DESC
+            LIMIT ?
             """
 
-            results = conn.execute(query).fetchall()
-            data = [{
-                'store_name': r['store_name'],
-                'avg_rate': round(r['avg_rate'], 1),
-                'weeks_count': r['weeks_count']
-            } for r in results[:limit]]
-            data = [{
-                'store_name': r['store_name'],
-                'avg_rate': round(r['avg_rate'], 1),
-                'weeks_count': r['weeks_count']
-            } for r in results]
-
-            return jsonify({'status': 'success', 'data': data})
+            # 件数制限と丸めはSQL側で行い、行はそのまま辞書に変換する（並び順は丸める前の値）
+            # （LIMIT をパラメータにして文の再利用を効かせる）
+            data = [dict(r) for r in conn.execute(query, [limit])]
+
+            return json_response({'status': 'success', 'data': data})
         except Exception as e:
-            return jsonify({'status': 'error', 'message': str(e)}), 500
+            return json_response({'status': 'error', 'message': str(e)}, 500)
 
     @bp.route('/averages/daily')
     def get_daily_averages():
         """日次平均データを取得"""
         try:
             conn = get_db_connection()
+            # 集計処理で差分更新している日付・店舗別の合計を参照する（store_status 全体を集計しない）
             query = """
-            SELECT date(timestamp) as date,
-                   AVG(CASE WHEN working_staff > 0 
-                       THEN CAST((working_staff - active_staff) AS FLOAT) / working_staff * 100 
-                       ELSE 0 END) as avg_rate,
-                   COUNT(DISTINCT store_name) as store_count
-            FROM store_status
-            GROUP BY date(timestamp)
+            SELECT date,
+                   ROUND(SUM(rate_sum) / SUM(sample_count), 1) as avg_rate,
+                   COUNT(*) as store_count
+            FROM store_daily_stats
+            GROUP BY date
             ORDER BY date DESC
             LIMIT 30
             """
-            results = conn.execute(query).fetchall()
-            data = [{
-                'date': r['date'],
-                'avg_rate': round(r['avg_rate'], 1),
-                'store_count': r['store_count']
-            } for r in results]
-            return jsonify({'status': 'success', 'data': data})
+            data = [dict(r) for r in conn.execute(query)]
+            return json_response({'status': 'success', 'data': data})
         except Exception as e:
-            return jsonify({'status': 'error', 'message': str(e)}), 500
+            return json_response({'status': 'error', 'message': str(e)}, 500)
 
     @bp.route('/averages/monthly')
     def get_monthly_averages():
         """月次平均データを取得"""
         try:
             conn = get_db_connection()
+            # 日付・店舗別の合計を月（日付の先頭7文字）ごとにまとめる
             query = """
-            SELECT strftime('%Y-%m', timestamp) as month,
-                   AVG(CASE WHEN working_staff > 0 
-                       THEN CAST((working_staff - active_staff) AS FLOAT) / working_staff * 100 
-                       ELSE 0 END) as avg_rate,
+            SELECT substr(date, 1, 7) as month,
+                   ROUND(SUM(rate_sum) / SUM(sample_count), 1) as avg_rate,
                    COUNT(DISTINCT store_name) as store_count
-            FROM store_status
-            GROUP BY strftime('%Y-%m', timestamp)
+            FROM store_daily_stats
+            GROUP BY substr(date, 1, 7)
             ORDER BY month DESC
             LIMIT 12
             """
-            results = conn.execute(query).fetchall()
-            data = [{
-                'month': r['month'],
-                'avg_rate': round(r['avg_rate'], 1),
-                'store_count': r['store_count']
-            } for r in results]
-            return jsonify({'status': 'success', 'data': data})
+            data = [dict(r) for r in conn.execute(query)]
+            return json_response({'status': 'success', 'data': data})
         except Exception as e:
-            return jsonify({'status': 'error', 'message': str(e)}), 500
+            return json_response({'status': 'error', 'message': str(e)}, 500)
 
     @bp.route('/averages/stores')
     def get_store_averages():
@@ -542,9 +550,9 @@ def register_api_routes(bp):
             conn = get_db_connection()
             query = """
             SELECT store_name,
-                   AVG(CASE WHEN working_staff > 0 
+                   ROUND(AVG(CASE WHEN working_staff > 0 
                        THEN CAST((working_staff - active_staff) AS FLOAT) / working_staff * 100 
-                       ELSE 0 END) as avg_rate,
+                       ELSE 0 END), 1) as avg_rate,
                    COUNT(*) as sample_count
             FROM store_status
             GROUP BY store_name
@@ -552,15 +560,11 @@ def register_api_routes(bp):
             ORDER BY avg_rate DESC
             LIMIT 50
             """
-            results = conn.execute(query).fetchall()
-            data = [{
-                'store_name': r['store_name'],
-                'avg_rate': round(r['avg_rate'], 1),
-                'sample_count': r['sample_count']
-            } for r in results]
-            return jsonify({'status': 'success', 'data': data})
+            # 丸めはSQL側で行い、行はそのまま辞書に変換する
+            data = [dict(r) for r in conn.execute(query)]
+            return json_response({'status': 'success', 'data': data})
         except Exception as e:
-            return jsonify({'status': 'error', 'message': str(e)}), 500
+            return json_response({'status': 'error', 'message': str(e)}, 500)
 
     @bp.route('/report/all-stores/excel', methods=['GET'])
     def generate_all_stores_excel_report():
@@ -568,34 +572,26 @@ def register_api_routes(bp):
         try:
             # 全店舗データの取得
             conn = get_db_connection()
-            stores_data = conn.execute("""
+            # 稼働率はSQL側で計算済みのため、カーソルから直接行を辞書に変換するだけ
+            stores_list = [dict(store) for store in conn.execute("""
                 WITH latest_data AS (
                     SELECT store_name, MAX(timestamp) as max_time
                     FROM store_status
                     GROUP BY store_name
                 )
-                SELECT s.* 
+                SELECT s.*,
+                       ROUND(CASE WHEN s.working_staff > 0
+                           THEN (s.working_staff - s.active_staff) * 100.0 / s.working_staff
+                           ELSE 0 END, 1) AS rate
                 FROM store_status s
                 JOIN latest_data l 
                     ON s.store_name = l.store_name 
                     AND s.timestamp = l.max_time
                 ORDER BY s.store_name
-            """).fetchall()
-
-            if not stores_data:
-                return jsonify({'status': 'error', 'message': '店舗データが見つかりません'}), 404
-
-            # データの整形
-            stores_list = []
-            for store in stores_data:
-                store_dict = dict(store)
-                working_staff = int(store_dict.get('working_staff', 0))
-                active_staff = int(store_dict.get('active_staff', 0))
-                rate = 0
-                if working_staff > 0:
-                    rate = round(((working_staff - active_staff) / working_staff) * 100, 1)
-                store_dict['rate'] = rate
-                stores_list.append(store_dict)
+            """)]
+
+            if not stores_list:
+                return json_response({'status': 'error', 'message': '店舗データが見つかりません'}, 404)
 
             try:
                 # レポート生成
@@ -620,13 +616,13 @@ def register_api_routes(bp):
                 )
             except Exception as e:
                 logger.error(f"PDFレポート生成エラー: {str(e)}")
-                return jsonify({
+                return json_response({
                     'status': 'error',
                     'message': f'PDFレポートの生成に失敗しました: {str(e)}'
-                }), 500
+                }, 500)
 
         except Exception as e:
-            return jsonify({'status': 'error', 'message': str(e)}), 500
+            return json_response({'status': 'error', 'message': str(e)}, 500)
 
     @bp.route('/ranking/average')
     def get_store_ranking():
@@ -637,39 +633,18 @@ def register_api_routes(bp):
 
             conn = get_db_connection()
 
+            # 集計処理で保存済みの店舗別ランキングを参照する
             query = """
-            WITH store_rates AS (
-                SELECT 
-                    store_name,
-                    biz_type,
-                    genre,
-                    area,
-                    AVG(CASE WHEN working_staff > 0 
-                        THEN CAST((working_staff - active_staff) AS FLOAT) / working_staff * 100 
-                        ELSE 0 END) as avg_rate,
-                    COUNT(*) as sample_count
-                FROM store_status
-                WHERE biz_type = ?
-                GROUP BY store_name, biz_type, genre, area
-                HAVING sample_count >= 5
-            )
-            SELECT *
-            FROM store_rates
-            ORDER BY avg_rate DESC
+            SELECT store_name, biz_type, genre, area, ROUND(avg_rate, 1) AS avg_rate, sample_count
+            FROM store_rankings
+            WHERE biz_type = ?
+            ORDER BY store_rankings.avg_rate DESC
             LIMIT ?
             """
 
-            results = conn.execute(query, [biz_type, limit]).fetchall()
-
-            data = [{
-                'store_name': r['store_name'],
-                'biz_type': r['biz_type'],
-                'genre': r['genre'],
-                'area': r['area'],
-                'avg_rate': round(r['avg_rate'], 1),
-                'sample_count': r['sample_count']
-            } for r in results]
+            # 丸めはSQL側で行い、行はそのまま辞書に変換する（並び順は丸める前の値）
+            data = [dict(r) for r in conn.execute(query, [biz_type, limit])]
 
-            return jsonify({'status': 'success', 'data': data})
+            return json_response({'status': 'success', 'data': data})
         except Exception as e:
-            return jsonify({'status': 'error', 'message': str(e)}), 500
\ No newline at end of file
+            return json_response({'status': 'error', 'message': str(e)}, 500)
\ No newline at end of file
@@ -1,6 +1,5 @@
 from flask import Blueprint, jsonify
-from datetime import datetime
-import pytz
+from datetime import datetime, timezone
 from api_endpoints import register_api_routes # Assuming this function exists and handles other routes
 
 
@@ -26,7 +25,7 @@ def get_dashboard_data():
                 "timestamps": [d.isoformat() for d in data['dates']],
                 "values": data['values'],
                 "metadata": {
-                    "last_updated": datetime.now(pytz.UTC).isoformat()
+                    "last_updated": datetime.now(timezone.utc).isoformat()
                 }
             }
         })
@@ -1,12 +1,32 @@
 import sqlite3
 
+# store_status から集計して作るテーブル（元データと一緒に消し、次回の集計で全期間を作り直させる）
+DERIVED_TABLES = (
+    "store_status_current",
+    "store_daily_stats",
+    "daily_stats",
+    "daily_averages",
+    "weekly_averages",
+    "monthly_averages",
+    "store_averages",
+    "area_stats",
+    "genre_rankings",
+    "store_rankings",
+    "agg_watermark",
+)
+
 def clear_db():
     conn = sqlite3.connect("store_data.db")
     cur = conn.cursor()
     cur.execute("DELETE FROM store_status;")
+    # 集計テーブルは一度も集計していないDBには存在しないため、あるものだけ消す
+    existing = {name for (name,) in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table in DERIVED_TABLES:
+        if table in existing:
+            cur.execute(f"DELETE FROM {table};")
     conn.commit()
     conn.close()
-    print("store_status テーブルのデータを削除しました。")
+    print("store_status テーブルと集計テーブルのデータを削除しました。")
 
 if __name__ == "__main__":
     clear_db()
@@ -11,11 +11,13 @@ import logging
 パフォーマンス改善のためのインデックス作成スクリプト
 """
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def create_indices():
-    """データベースのパフォーマンス向上のためのインデックスを作成する"""
+def create_indices(force_analyze=True):
+    """
+    データベースのパフォーマンス向上のためのインデックスを作成する
+    force_analyze=False の場合、インデックスに変更があったときだけ ANALYZE を実行する
+    """
     try:
         conn = get_db_connection()
         logger.info("インデックス作成を開始します...")
@@ -27,13 +29,31 @@ def create_indices():
         
         # 作成するインデックスのリスト
         indices_to_create = [
-            ("CREATE INDEX IF NOT EXISTS idx_store_status_timestamp ON store_status(timestamp);", "timestamp"),
+            # 期間指定の履歴取得（timestamp の範囲検索）をテーブルを読まずに済ませるカバリングインデックス
+            # 先頭列が timestamp のため単独の timestamp インデックス（このスクリプトとORMが作っていたもの）の代わりになる
+            ("DROP INDEX IF EXISTS idx_store_status_timestamp;", "drop_timestamp"),
+            ("DROP INDEX IF EXISTS ix_store_status_timestamp;", "drop_orm_timestamp"),
+            ("CREATE INDEX IF NOT EXISTS ix_store_status_ts_cover ON store_status(timestamp, store_name, working_staff, active_staff, total_staff);", "store_status_ts_cover"),
             ("CREATE INDEX IF NOT EXISTS idx_store_status_store_name ON store_status(store_name);", "store_name"),
             ("CREATE INDEX IF NOT EXISTS idx_store_status_area ON store_status(area);", "area"),
             ("CREATE INDEX IF NOT EXISTS idx_store_status_biz_type ON store_status(biz_type);", "biz_type"),
             ("CREATE INDEX IF NOT EXISTS idx_store_status_genre ON store_status(genre);", "genre"),
             ("CREATE INDEX IF NOT EXISTS idx_store_status_store_name_timestamp ON store_status(store_name, timestamp);", "store_name_timestamp"),
             ("CREATE INDEX IF NOT EXISTS idx_daily_stats_date ON daily_stats(date);", "daily_stats_date"),
+            # 期間別平均の集計クエリ用カバリングインデックス（working_staff > 0 の部分インデックス）
+            ("CREATE INDEX IF NOT EXISTS ix_store_status_agg ON store_status(timestamp, store_name, working_staff, active_staff, biz_type, genre, area) WHERE working_staff > 0;", "store_status_agg"),
+            # 店舗別平均（HAVING sample_count >= N）の集計用カバリングインデックス
+            ("CREATE INDEX IF NOT EXISTS ix_store_status_name_staff ON store_status(store_name, working_staff, active_staff);", "store_status_name_staff"),
+            # 日付・店舗別稼働率（store_daily_stats）の再集計用の式インデックス（クエリ側も同じ substr 式を使うこと）
+            ("CREATE INDEX IF NOT EXISTS ix_store_status_day ON store_status(substr(timestamp, 1, 10), store_name, working_staff, active_staff);", "store_status_day"),
+            # 集計済みランキングの ORDER BY avg_rate DESC をソートなしでインデックス順に読む
+            ("CREATE INDEX IF NOT EXISTS ix_daily_averages_rate ON daily_averages(avg_rate DESC);", "daily_averages_rate"),
+            ("CREATE INDEX IF NOT EXISTS ix_weekly_averages_rate ON weekly_averages(avg_rate DESC);", "weekly_averages_rate"),
+            ("CREATE INDEX IF NOT EXISTS ix_monthly_averages_rate ON monthly_averages(avg_rate DESC);", "monthly_averages_rate"),
+            ("CREATE INDEX IF NOT EXISTS ix_store_averages_rate ON store_averages(avg_rate DESC);", "store_averages_rate"),
+            # 業種で絞り込むランキングは (biz_type, avg_rate DESC) で LIMIT 件だけ読む
+            ("CREATE INDEX IF NOT EXISTS ix_store_rankings_biz_rate ON store_rankings(biz_type, avg_rate DESC);", "store_rankings_biz_rate"),
+            ("CREATE INDEX IF NOT EXISTS ix_genre_rankings_biz_rate ON genre_rankings(biz_type, avg_rate DESC);", "genre_rankings_biz_rate"),
         ]
         
         # インデックスを作成
@@ -53,17 +73,20 @@ def create_indices():
         logger.info(f"作成後のインデックス: {indices_after_list}")
         
         # ANALYZE実行（SQLiteのクエリプランナーの最適化）
-        logger.info("ANALYZEを実行してクエリプランナーを最適化します...")
-        conn.execute("ANALYZE;")
-        conn.commit()
+        if force_analyze or set(indices_after_list) != set(existing_indices):
+            logger.info("ANALYZEを実行してクエリプランナーを最適化します...")
+            conn.execute("ANALYZE;")
+            conn.commit()
         
         logger.info("インデックス作成が完了しました")
-        conn.close()
+        # 接続はスレッド内で使い回すため閉じない
         return True
     except Exception as e:
         logger.error(f"インデックス作成中に予期しないエラーが発生しました: {e}")
         return False
 
 if __name__ == "__main__":
+    # スクリプトとして実行した場合のみロギングを設定する（インポート時はアプリの設定に従う）
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     success = create_indices()
     sys.exit(0 if success else 1)
@@ -3,6 +3,7 @@ from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 import sqlite3
 import datetime
+import threading
 
 # 環境変数から DATABASE_URL を取得、なければ SQLite を使用
 DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///store_data.db')
@@ -13,11 +14,36 @@ engine = create_engine(DATABASE_URL, echo=True)
 # セッションの作成
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 接続ごとに設定する性能関係のPRAGMA（ORMのエンジンにも models.py で同じものを設定する）
+SQLITE_PERFORMANCE_PRAGMAS = (
+    # 一時テーブル・ソート領域をメモリ上に確保（GROUP BYのディスク書き出しを防ぐ）
+    "PRAGMA temp_store = MEMORY",
+    # ページキャッシュを64MBに拡張（負数はKB単位）
+    "PRAGMA cache_size = -64000",
+    # メモリマップI/Oで大きな範囲スキャンを高速化
+    "PRAGMA mmap_size = 2147483648",
+)
+
+# スレッドごとに使い回すSQLite接続（接続のオープンとPRAGMA設定をリクエストごとに行わない）
+_local = threading.local()
+
 # データベース接続を取得する関数
 def get_db_connection():
-    """データベース接続を取得する関数"""
+    """
+    データベース接続を取得する関数
+    同じスレッドでは接続を使い回す（呼び出し側で close() された場合は開き直す）
+    """
     import logging
     logger = logging.getLogger('app')
+
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        try:
+            # 閉じられた接続では ProgrammingError になる
+            conn.total_changes
+            return conn
+        except sqlite3.ProgrammingError:
+            _local.conn = None
     import sqlite3.dbapi2 as sqlite
     sqlite.encode = lambda x: x.encode('utf-8', 'ignore')
     sqlite.decode = lambda x: x.decode('utf-8', 'ignore')
@@ -118,10 +144,8 @@ def get_db_connection():
                     # スペース区切りの日時
                     elif ' ' in s:
                         try:
-                            if '.' in s:
-                                return datetime.datetime.strptime(s, '%Y-%m-%d %H:%M:%S.%f')
-                            else:
-                                return datetime.datetime.strptime(s, '%Y-%m-%d %H:%M:%S')
+                            # fromisoformat はC実装でstrptimeより大幅に速い（マイクロ秒の有無も両対応）
+                            return datetime.datetime.fromisoformat(s)
                         except ValueError:
                             # 日付部分だけ解析
                             date_part = s.split(' ')[0]
@@ -151,12 +175,16 @@ def get_db_connection():
         conn.execute("PRAGMA journal_mode = WAL")
         # 同期モードの最適化
         conn.execute("PRAGMA synchronous = NORMAL")
+        # 一時領域・ページキャッシュ・メモリマップの設定
+        for pragma in SQLITE_PERFORMANCE_PRAGMAS:
+            conn.execute(pragma)
 
         # 接続テスト
         test_query = "SELECT COUNT(*) FROM store_status"
         result = conn.execute(test_query).fetchone()
         logger.info(f"データベース接続成功: store_statusテーブルのレコード数 = {result[0]}")
 
+        _local.conn = conn
         return conn
     except Exception as e:
         logger.error(f"データベース接続エラー: {e}")
@@ -1,7 +1,7 @@
 import os
 import logging
-import pytz
 from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 
 from flask import Flask, render_template, redirect, url_for
 
@@ -14,11 +14,12 @@ from flask_socketio import SocketIO
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.executors.pool import ProcessPoolExecutor
 
-from models import db
+from models import db, AggregationWatermark
 from api_routes import api_bp
 from api_endpoints import init_cache
 from store_scraper import scrape_store_data
-from aggregated_data import AggregatedData
+from aggregated_data import AggregatedData, init_cache as init_aggregated_cache
+from create_indices import create_indices
 
 # ロギング設定
 logging.basicConfig(
@@ -65,7 +66,11 @@ werkzeug.urls.url_quote = patched_url_quote
 os.makedirs('./flask_session', exist_ok=True)
 
 # データベース設定
-DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///store_data.db')
+# Flask-SQLAlchemy は相対パスのSQLiteをinstanceフォルダ基準で解決するため、
+# get_db_connection() と同じファイルを参照するよう絶対パスで指定する
+# 移行時の注意: 以前は ORM だけが instance/store_data.db を使っていた。管理画面で登録した店舗URLは
+# そちらに残っているため、必要なら store_urls を ./store_data.db へコピーすること
+DATABASE_URL = os.environ.get('DATABASE_URL', f"sqlite:///{os.path.abspath('store_data.db')}")
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
@@ -92,13 +97,14 @@ if os.environ.get('REDIS_URL'):
 else:
     # 開発環境: SimpleCache利用
     app.config['CACHE_TYPE'] = 'SimpleCache'
-    app.config['CACHE_DEFAULT_TIMEOUT'] = 300
 
+app.config['CACHE_DEFAULT_TIMEOUT'] = 300
 app.config['CACHE_KEY_PREFIX'] = 'msa_v1_'
 app.config['CACHE_THRESHOLD'] = 1000
 
 cache = Cache(app)
 init_cache(cache)  # API設定にキャッシュインスタンスを渡す
+init_aggregated_cache(cache)  # 集計データの参照キャッシュにも同じインスタンスを使う
 
 # SocketIO
 socketio = SocketIO(app, async_mode='threading')
@@ -112,7 +118,7 @@ with app.app_context():
 app.register_blueprint(api_bp, url_prefix='/api')
 
 # スケジューリング用の設定
-jst = pytz.timezone('Asia/Tokyo')
+jst = ZoneInfo('Asia/Tokyo')
 executors = {'default': ProcessPoolExecutor(max_workers=1)}
 scheduler = BackgroundScheduler(executors=executors, timezone=jst)
 
@@ -126,7 +132,6 @@ def scheduled_scrape():
         logger.info("定期スクレイピングを開始します")
 
         # スクレイピング実行時刻（JSTタイムゾーン）
-        jst = pytz.timezone('Asia/Tokyo')
         scrape_time = datetime.now(jst)
 
         # 対象URLを取得
@@ -169,7 +174,6 @@ def scheduled_scrape():
                 """
                 existing = conn.execute(existing_query, 
                                       [store_name, area, formatted_time]).fetchone()
-                conn.close()
 
                 if existing:
                     # 既存レコードを更新
@@ -193,7 +197,6 @@ def scheduled_scrape():
                         existing['id']
                     ])
                     conn.commit()
-                    conn.close()
                     record_update_count += 1
                 else:
                     # 新規レコードを追加
@@ -217,18 +220,21 @@ def scheduled_scrape():
                         record.get('shift_time', '')
                     ])
                     conn.commit()
-                    conn.close()
                     record_insert_count += 1
 
             logger.info(f"DB処理完了: 更新={record_update_count}件, 新規追加={record_insert_count}件")
 
-            # 集計データの更新
-            AggregatedData.calculate_and_save_aggregated_data()
+            # 集計データの更新（既存行を更新した場合は新しいIDがなくても集計し直す）
+            AggregatedData.calculate_and_save_aggregated_data(force=record_update_count > 0)
 
             # キャッシュをクリア（キャッシュミスを防ぐためにエラーを捕捉）
             try:
                 cache.clear()
                 logger.info("キャッシュをクリアしました")
+                # 最初のリクエストが再計算を待たないよう、集計結果のキャッシュを先に作る
+                # このジョブはプロセスプールで動くため、Webプロセスと共有できるRedisの場合だけ行う
+                if app.config['CACHE_TYPE'] == 'RedisCache':
+                    AggregatedData.warm_cache()
             except Exception as cache_err:
                 logger.error(f"キャッシュクリア中にエラーが発生しました: {cache_err}")
 
@@ -238,7 +244,21 @@ def scheduled_scrape():
         except Exception as e:
             logger.error(f"スクレイピング処理中にエラーが発生しました: {e}")
 
+# 起動直後に一度だけ実行する初期化処理
+def initial_aggregation():
+    """インデックスを作成し、一度も集計していなければ集計済みテーブルを作る"""
+    with app.app_context():
+        # 最新行の取得や集計で使うインデックスを作成（既存のものはそのまま）
+        if db.engine.dialect.name == 'sqlite':
+            create_indices(force_analyze=False)
+        # 集計済みテーブルは定期スクレイピングの後にしか作られないため、
+        # 一度も集計していなければここで作っておく（初回の集計までAPIが空の結果を返さないようにする）
+        if db.session.get(AggregationWatermark, 1) is None:
+            AggregatedData.calculate_and_save_aggregated_data()
+
 # スケジューラーにジョブを登録
+# 初期化はインポート時に同期実行せず、起動直後のジョブとして実行する（サーバーの起動を待たせない）
+scheduler.add_job(initial_aggregation, next_run_time=datetime.now(jst), id='initial_aggregation_job')
 scheduler.add_job(scheduled_scrape, 'interval', hours=1, id='scrape_job')
 scheduler.add_job(lambda: cache.clear(), 'cron', hour=3, minute=0, id='cache_clear_job')
 scheduler.start()
@@ -442,7 +462,6 @@ def delayed_initial_setup():
 # メイン実行部分
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
-    jst = pytz.timezone('Asia/Tokyo')
     now_jst = datetime.now(jst)
     logger.info(f"サーバー起動時刻（JST）: {now_jst.strftime('%Y-%m-%d %H:%M:%S %Z%z')}")
     
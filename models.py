@@ -3,11 +3,29 @@
 データベースモデルの定義
 """
 
-from sqlalchemy import Column, Integer, Float, Text, DateTime, func
+import sqlite3
+
+from sqlalchemy import Column, Integer, Float, Text, DateTime, func, event
+from sqlalchemy.engine import Engine
 from flask_sqlalchemy import SQLAlchemy
 
+from database import SQLITE_PERFORMANCE_PRAGMAS
+
 db = SQLAlchemy()
 
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    ORMのSQLite接続にも get_db_connection() と同じPRAGMAを設定する
+    集計処理（一時テーブルやGROUP BYの再構築）はORMのエンジンで実行されるため
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PERFORMANCE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
 class StoreStatus(db.Model):
     """
     店舗ごとのスクレイピング結果を保存するテーブル。
@@ -15,7 +33,8 @@ class StoreStatus(db.Model):
     """
     __tablename__ = 'store_status'
     id = Column(Integer, primary_key=True)
-    timestamp = Column(DateTime, server_default=func.now(), index=True)
+    # timestamp の範囲検索は create_indices.py のカバリングインデックス（先頭列が timestamp）を使う
+    timestamp = Column(DateTime, server_default=func.now())
     store_name = Column(Text)
     biz_type = Column(Text)
     genre = Column(Text)
@@ -96,6 +115,16 @@ class DailyStats(db.Model):
     last_updated = Column(DateTime, default=func.now())
 
 
+class StoreDailyStats(db.Model):
+    """日付・店舗ごとの稼働率の合計（日次・週次・月次平均APIの参照用、集計時に当日分から差分更新）"""
+    __tablename__ = 'store_daily_stats'
+    date = Column(Text, primary_key=True)
+    store_name = Column(Text, primary_key=True)
+    rate_sum = Column(Float, default=0.0)
+    sample_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=func.now())
+
+
 class StoreAverage(db.Model):
     """店舗ごとの全期間平均稼働率（2年以内）"""
     __tablename__ = 'store_averages'
@@ -109,3 +138,63 @@ class StoreAverage(db.Model):
     genre = Column(Text)
     area = Column(Text)
     updated_at = Column(DateTime, default=func.now())
+
+
+class StoreStatusCurrent(db.Model):
+    """各店舗の最新の store_status 行（集計時に作り直す）"""
+    __tablename__ = 'store_status_current'
+    id = Column(Integer, primary_key=True)
+    timestamp = Column(DateTime)
+    store_name = Column(Text)
+    biz_type = Column(Text)
+    genre = Column(Text)
+    area = Column(Text)
+    total_staff = Column(Integer)
+    working_staff = Column(Integer)
+    active_staff = Column(Integer)
+    url = Column(Text)
+    shift_time = Column(Text)
+
+
+class AreaStat(db.Model):
+    """エリア別の統計（各店舗の最新データから集計）"""
+    __tablename__ = 'area_stats'
+    id = Column(Integer, primary_key=True)
+    area = Column(Text)
+    store_count = Column(Integer)
+    avg_rate = Column(Float)
+    updated_at = Column(DateTime, default=func.now())
+
+
+class GenreRanking(db.Model):
+    """業種・ジャンル別の平均稼働率（各店舗の最新データから集計）"""
+    __tablename__ = 'genre_rankings'
+    id = Column(Integer, primary_key=True)
+    biz_type = Column(Text, index=True)
+    genre = Column(Text)
+    store_count = Column(Integer)
+    avg_rate = Column(Float)
+    updated_at = Column(DateTime, default=func.now())
+
+
+class StoreRanking(db.Model):
+    """店舗別の全期間平均稼働率ランキング"""
+    __tablename__ = 'store_rankings'
+    id = Column(Integer, primary_key=True)
+    store_name = Column(Text)
+    biz_type = Column(Text, index=True)
+    genre = Column(Text)
+    area = Column(Text)
+    avg_rate = Column(Float)
+    sample_count = Column(Integer)
+    updated_at = Column(DateTime, default=func.now())
+
+
+class AggregationWatermark(db.Model):
+    """最後に集計したstore_statusの最大IDと行数（1行のみ）"""
+    __tablename__ = 'agg_watermark'
+    id = Column(Integer, primary_key=True)
+    last_status_id = Column(Integer, default=0)
+    # 行の削除を検出するため、集計時点の store_status の行数も持つ
+    status_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=func.now())
@@ -1,9 +1,15 @@
-import pytz
-from datetime import datetime
+from datetime import datetime, timezone as dt_timezone
+from zoneinfo import ZoneInfo
 from flask import request, abort
+from sqlalchemy import func
 from math import ceil
 import logging
 
+logger = logging.getLogger('app')
+
+# 日本のタイムゾーン（呼び出しごとに生成しない）
+JST = ZoneInfo('Asia/Tokyo')
+
 def paginate_query_results(query, page, per_page, max_per_page=100):
     """
     SQLAlchemy クエリオブジェクトに対してページネーションを適用する
@@ -25,11 +31,17 @@ def paginate_query_results(query, page, per_page, max_per_page=100):
     if per_page > max_per_page:
         per_page = max_per_page
 
-    # 結果を取得
-    items = query.limit(per_page).offset((page - 1) * per_page).all()
-
-    # 総アイテム数とページ数を計算
-    total_count = query.count()
+    # 結果と総アイテム数を1回のクエリで取得（COUNT(*) OVER () はLIMIT適用前の件数になる）
+    rows = query.add_columns(func.count().over()).limit(per_page).offset((page - 1) * per_page).all()
+    if rows:
+        total_count = rows[0][-1]
+        items = [row[0] if len(row) == 2 else tuple(row[:-1]) for row in rows]
+    else:
+        # 範囲外のページでは総件数が取れないため、その場合だけ件数を数える
+        total_count = query.count() if page > 1 else 0
+        items = []
+
+    # ページ数を計算
     total_pages = ceil(total_count / per_page) if per_page > 0 else 0
 
     # 次のページと前のページがあるかどうか
@@ -49,7 +61,23 @@ def paginate_query_results(query, page, per_page, max_per_page=100):
         }
     }
 
-def format_store_status(item, timezone=None):
+def _parse_iso_timestamp(value):
+    """
+    ISO形式（'T'区切り・スペース区切りの両方）のタイムスタンプを1回の fromisoformat で変換する
+    変換できない場合は None を返す
+    """
+    if 'Z' in value:
+        value = value.replace('Z', '+00:00')
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    # タイムゾーン情報のない'T'区切りの値はUTCとみなす（従来の変換と同じ扱い）
+    if timestamp.tzinfo is None and 'T' in value:
+        timestamp = timestamp.replace(tzinfo=dt_timezone.utc)
+    return timestamp
+
+def format_store_status(item, timezone=None, now=None):
     """
     店舗ステータスレコードを整形してフロントエンド用JSONに変換する関数
 
@@ -57,18 +85,20 @@ def format_store_status(item, timezone=None):
     -----------
     item : dict or SQLAlchemy model
         変換する店舗ステータスレコード
-    timezone : pytz timezone object, optional
+    timezone : tzinfo, optional
         変換先のタイムゾーン（指定しない場合はUTC）
+    now : datetime, optional
+        タイムスタンプが欠けている場合に使う現在時刻
+        （複数件を整形する場合は呼び出し側で一度だけ取得して渡す）
 
     Returns:
     --------
     dict
         整形されたJSONオブジェクト
     """
-    import logging
-    import datetime
-    import pytz
-    logger = logging.getLogger('app')
+    # 現在時刻はタイムスタンプが使えない場合にだけ必要なため、そのときに初めて取得する
+    def current_time():
+        return now if now is not None else datetime.now()
 
     # SQLAlchemy モデルオブジェクトの場合は辞書に変換
     if hasattr(item, '__dict__'):
@@ -96,7 +126,7 @@ def format_store_status(item, timezone=None):
         logger.error(f"未対応の型: {type(item)}")
         return {
             'id': None,
-            'timestamp': datetime.datetime.now().isoformat(),
+            'timestamp': current_time().isoformat(),
             'store_name': '不明',
             'biz_type': '不明',
             'genre': '不明',
@@ -115,92 +145,97 @@ def format_store_status(item, timezone=None):
         timestamp = item.get('timestamp')
 
         if timestamp is not None:
-            if isinstance(timestamp, datetime.datetime):
+            if isinstance(timestamp, datetime):
                 # すでにdatetime型の場合は何もしない
                 pass
             elif isinstance(timestamp, str):
-                try:
-                    # ISO 8601形式のパース（マイクロ秒対応）
-                    if 'T' in timestamp:
-                        # Z形式をタイムゾーン付きに変換
-                        iso_str = timestamp.replace('Z', '+00:00')
+                # 大半はISO形式のため、まず1回の fromisoformat で変換し、失敗した場合だけ従来の解析を行う
+                parsed = _parse_iso_timestamp(timestamp)
+                if parsed is not None:
+                    timestamp = parsed
+                else:
+                    try:
+                        # ISO 8601形式のパース（マイクロ秒対応）
+                        if 'T' in timestamp:
+                            # Z形式をタイムゾーン付きに変換
+                            iso_str = timestamp.replace('Z', '+00:00')
                         
-                        # タイムゾーン情報がない場合
-                        if '+' not in iso_str and '-' not in iso_str[10:]:
-                            iso_str = iso_str + '+00:00'
+                            # タイムゾーン情報がない場合
+                            if '+' not in iso_str and '-' not in iso_str[10:]:
+                                iso_str = iso_str + '+00:00'
                         
-                        try:
-                            # Python 3.7以降はfromisoformatを使用
-                            if hasattr(datetime.datetime, 'fromisoformat'):
-                                timestamp = datetime.datetime.fromisoformat(iso_str)
-                            else:
-                                # マイクロ秒ありのフォーマット対応
-                                if '.' in iso_str:
-                                    main_part = iso_str.split('+')[0]
-                                    timestamp = datetime.datetime.strptime(main_part, '%Y-%m-%dT%H:%M:%S.%f')
+                            try:
+                                # Python 3.7以降はfromisoformatを使用
+                                if hasattr(datetime, 'fromisoformat'):
+                                    timestamp = datetime.fromisoformat(iso_str)
                                 else:
-                                    # マイクロ秒なし
-                                    main_part = iso_str.split('+')[0]
-                                    timestamp = datetime.datetime.strptime(main_part, '%Y-%m-%dT%H:%M:%S')
-                        except ValueError as e:
-                            logger.warning(f"ISO形式のパースに失敗、フォールバック: {e}")
-                            # マイクロ秒形式を直接試す（database.pyのエラーに対応）
+                                    # マイクロ秒ありのフォーマット対応
+                                    if '.' in iso_str:
+                                        main_part = iso_str.split('+')[0]
+                                        timestamp = datetime.strptime(main_part, '%Y-%m-%dT%H:%M:%S.%f')
+                                    else:
+                                        # マイクロ秒なし
+                                        main_part = iso_str.split('+')[0]
+                                        timestamp = datetime.strptime(main_part, '%Y-%m-%dT%H:%M:%S')
+                            except ValueError as e:
+                                logger.warning(f"ISO形式のパースに失敗、フォールバック: {e}")
+                                # マイクロ秒形式を直接試す（database.pyのエラーに対応）
+                                try:
+                                    if '.' in timestamp:
+                                        parts = timestamp.split('.')
+                                        base = parts[0]
+                                        # 最大6桁のマイクロ秒まで処理
+                                        micro = parts[1][:6]
+                                        if len(micro) < 6:
+                                            micro = micro.ljust(6, '0')
+                                        timestamp = datetime.strptime(f"{base}.{micro}", '%Y-%m-%dT%H:%M:%S.%f')
+                                    else:
+                                        timestamp = datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S')
+                                except ValueError:
+                                    # 日付部分だけを使用
+                                    try:
+                                        date_part = timestamp.split('T')[0]
+                                        timestamp = datetime.strptime(date_part, '%Y-%m-%d')
+                                    except ValueError:
+                                        logger.warning(f"日付変換に最終的に失敗: {timestamp}")
+                                        timestamp = current_time()
+                        else:
+                            # 通常の日時形式を試す
                             try:
                                 if '.' in timestamp:
-                                    parts = timestamp.split('.')
-                                    base = parts[0]
-                                    # 最大6桁のマイクロ秒まで処理
-                                    micro = parts[1][:6]
-                                    if len(micro) < 6:
-                                        micro = micro.ljust(6, '0')
-                                    timestamp = datetime.datetime.strptime(f"{base}.{micro}", '%Y-%m-%dT%H:%M:%S.%f')
+                                    timestamp = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S.%f')
                                 else:
-                                    timestamp = datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S')
+                                    timestamp = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
                             except ValueError:
-                                # 日付部分だけを使用
+                                # 日付のみのフォーマット
                                 try:
-                                    date_part = timestamp.split('T')[0]
-                                    timestamp = datetime.datetime.strptime(date_part, '%Y-%m-%d')
+                                    timestamp = datetime.strptime(timestamp, '%Y-%m-%d')
                                 except ValueError:
-                                    logger.warning(f"日付変換に最終的に失敗: {timestamp}")
-                                    timestamp = datetime.datetime.now()
-                    else:
-                        # 通常の日時形式を試す
-                        try:
-                            if '.' in timestamp:
-                                timestamp = datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S.%f')
-                            else:
-                                timestamp = datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-                        except ValueError:
-                            # 日付のみのフォーマット
-                            try:
-                                timestamp = datetime.datetime.strptime(timestamp, '%Y-%m-%d')
-                            except ValueError:
-                                logger.warning(f"日付変換に失敗、現在時刻を使用: {timestamp}")
-                                timestamp = datetime.datetime.now()
-                except Exception as dt_err:
-                    logger.error(f"日付変換中の予期しないエラー: {dt_err}, 値: {timestamp}")
-                    timestamp = datetime.datetime.now()
+                                    logger.warning(f"日付変換に失敗、現在時刻を使用: {timestamp}")
+                                    timestamp = current_time()
+                    except Exception as dt_err:
+                        logger.error(f"日付変換中の予期しないエラー: {dt_err}, 値: {timestamp}")
+                        timestamp = current_time()
             else:
                 # 他の型の場合は現在時刻を使用
                 logger.warning(f"未対応のタイムスタンプ型: {type(timestamp)}")
-                timestamp = datetime.datetime.now()
+                timestamp = current_time()
         else:
             # タイムスタンプがない場合は現在時刻を使用
-            timestamp = datetime.datetime.now()
+            timestamp = current_time()
 
         # タイムゾーン変換
         if timezone and timestamp:
             try:
                 # タイムゾーン情報がない場合はUTCと仮定して変換
                 if not timestamp.tzinfo:
-                    timestamp = pytz.utc.localize(timestamp)
+                    timestamp = timestamp.replace(tzinfo=dt_timezone.utc)
                 # 指定されたタイムゾーンに変換
                 timestamp = timestamp.astimezone(timezone)
             except Exception as tz_err:
                 logger.error(f"タイムゾーン変換エラー: {tz_err}")
                 # エラー時は現在時刻を使用
-                timestamp = datetime.datetime.now(timezone)
+                timestamp = current_time().astimezone(timezone)
 
         # 文字列がない場合は"不明"、数値がない場合は0にする
         store_name = item.get('store_name', '不明')
@@ -245,16 +280,20 @@ def format_store_status(item, timezone=None):
         if shift_time is None:
             shift_time = ''
 
-        # 稼働率計算
-        rate = 0.0
-        if working_staff > 0:
-            rate = ((working_staff - active_staff) / working_staff) * 100
-            rate = round(rate, 1)  # 小数点第1位で丸める
+        # 稼働率計算（SQLで rate 列を計算済みの場合はそれを使う）
+        rate = item.get('rate')
+        if rate is not None:
+            rate = round(float(rate), 1)
+        else:
+            rate = 0.0
+            if working_staff > 0:
+                rate = ((working_staff - active_staff) / working_staff) * 100
+                rate = round(rate, 1)  # 小数点第1位で丸める
 
         # 整形済みデータ
         formatted = {
             'id': item.get('id'),
-            'timestamp': timestamp.isoformat() if timestamp else datetime.datetime.now().isoformat(),
+            'timestamp': timestamp.isoformat() if timestamp else current_time().isoformat(),
             'store_name': store_name,
             'biz_type': biz_type,
             'genre': genre,
@@ -281,7 +320,7 @@ def format_store_status(item, timezone=None):
 
             return {
                 'id': item.get('id'),
-                'timestamp': datetime.datetime.now().isoformat(),
+                'timestamp': current_time().isoformat(),
                 'store_name': store_name,
                 'biz_type': '不明',
                 'genre': '不明',
@@ -298,7 +337,7 @@ def format_store_status(item, timezone=None):
             logger.error(f"フォールバックデータ作成エラー: {fallback_err}")
             return {
                 'id': None,
-                'timestamp': datetime.datetime.now().isoformat(),
+                'timestamp': current_time().isoformat(),
                 'store_name': '不明',
                 'biz_type': '不明',
                 'genre': '不明',
@@ -315,8 +354,7 @@ def format_store_status(item, timezone=None):
 def prepare_data_for_integrated_dashboard():
     """統合ダッシュボード用のデータを準備"""
     # 日本のタイムゾーンに設定
-    jst = pytz.timezone('Asia/Tokyo')
-    now = datetime.now(jst)
+    now = datetime.now(JST)
     jst_now = now.strftime('%Y年%m月%d日 %H:%M:%S %Z%z')
 
     return {
@@ -1,6 +1,5 @@
 import pandas as pd
 from datetime import datetime
-import pytz
 import os
 from openpyxl.styles import PatternFill, Font, Alignment, Border, Side, Color
 from openpyxl.chart import BarChart, Reference, PieChart
@@ -31,32 +30,15 @@ class ReportGenerator:
         output_path = output_path.replace('.pdf', '.xlsx')
 
         try:
-            # 期間情報の取得
-            dates = [store.get('timestamp') for store in stores_data if store.get('timestamp')]
-            start_date = min(dates).strftime('%Y/%m/%d %H:%M') if dates else 'N/A'
-            end_date = max(dates).strftime('%Y/%m/%d %H:%M') if dates else 'N/A'
-
             with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-                # サマリーシート
+                # サマリーシート（合計は1回の走査でまとめて求める）
                 total_stores = len(stores_data)
-                total_working = sum(store.get('working_staff', 0) for store in stores_data)
-                total_active = sum(store.get('active_staff', 0) for store in stores_data)
-                avg_rate = sum(store.get('rate', 0) for store in stores_data) / total_stores if total_stores > 0 else 0
-
-                summary_data = {
-                    '項目': ['集計期間（開始）', '集計期間（終了）', '総店舗数', '総勤務人数', '総即ヒメ数', '平均稼働率'],
-                    '値': [
-                        start_date,
-                        end_date,
-                        total_stores,
-                        total_working,
-                        total_active,
-                        f"{avg_rate:.1f}%"
-                    ]
-                }
-                total_working = sum(store.get('working_staff', 0) for store in stores_data)
-                total_active = sum(store.get('active_staff', 0) for store in stores_data)
-                avg_rate = sum(store.get('rate', 0) for store in stores_data) / total_stores if total_stores > 0 else 0
+                total_working = total_active = total_rate = 0
+                for store in stores_data:
+                    total_working += store.get('working_staff', 0)
+                    total_active += store.get('active_staff', 0)
+                    total_rate += store.get('rate', 0)
+                avg_rate = total_rate / total_stores if total_stores > 0 else 0
 
                 summary_data = {
                     '項目': ['総店舗数', '総勤務人数', '総即ヒメ数', '平均稼働率'],
@@ -8,7 +8,7 @@ import asyncio
 import logging
 import time
 from datetime import datetime
-import pytz
+from zoneinfo import ZoneInfo
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 import gc  # ガベージコレクションモジュール
@@ -16,11 +16,6 @@ import os
 import sys
 import psutil  # メモリ使用状況監視用にpsutilを追加
 
-# ロギング設定
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 # スクレイパーのインポート
@@ -160,7 +155,7 @@ def main():
         logger.info(f"スクレイピング後メモリ使用量: {memory_after_scrape:.1f}MB")
         
         # データベースに保存
-        timestamp = datetime.now(pytz.timezone('Asia/Tokyo'))
+        timestamp = datetime.now(ZoneInfo('Asia/Tokyo'))
         inserted = bulk_insert_results(results, timestamp)
         
         # 結果データは不要になったのでメモリ解放
@@ -187,4 +182,9 @@ def main():
         logger.error(traceback.format_exc())
 
 if __name__ == "__main__":
+    # ロギング設定（スクリプトとして実行した場合のみ）
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
     main()
@@ -4,7 +4,7 @@ from pyppeteer_stealth import stealth
 from bs4 import BeautifulSoup
 import re
 from datetime import datetime, timedelta
-import pytz
+from zoneinfo import ZoneInfo
 import gc
 import random
 
@@ -21,6 +21,8 @@ PAGE_LOAD_TIMEOUT = 15000  # ページロードのタイムアウト(15秒)に
 # メモリ管理
 FORCE_GC_AFTER_STORES = 40  # 40店舗処理後に強制GC実行（メモリ節約）
 MAX_RETRIES = 3 # 最大再試行回数
+# 日本標準時（zoneinfoは localize 不要で replace(tzinfo=...) だけで付与できる）
+JST = ZoneInfo('Asia/Tokyo')
 
 # ロギングレベルを設定
 import logging
@@ -176,7 +178,8 @@ async def scrape_store(browser, url: str, semaphore) -> dict:
         working_staff = 0   # 勤務中の人数
         active_staff = 0    # 「即ヒメ」（待機中）の人数
 
-        jst = pytz.timezone('Asia/Tokyo')
+        # 現在時刻は店舗ごとに一度だけ取得する
+        current_time = datetime.now(JST)
         # 各シフト（wrapper）ごとにループ処理
         for wrapper in wrappers:
             p_elems = wrapper.find_all("p", class_="time_font_size shadow shukkin_detail_time")
@@ -195,7 +198,6 @@ async def scrape_store(browser, url: str, semaphore) -> dict:
                 match = re.search(r"(\d{1,2}):(\d{2})～(\d{1,2}):(\d{2})", text)
                 if match:
                     start_h, start_m, end_h, end_m = map(int, match.groups())
-                    current_time = datetime.now(jst)
                     parsed_start = datetime.strptime(f"{start_h}:{start_m}", "%H:%M").time()
                     parsed_end = datetime.strptime(f"{end_h}:{end_m}", "%H:%M").time()
                     # シフトが日を跨ぐ場合の処理
@@ -210,8 +212,8 @@ async def scrape_store(browser, url: str, semaphore) -> dict:
                         start_time = datetime.combine(current_time.date(), parsed_start)
                         end_time = datetime.combine(current_time.date(), parsed_end)
                     # タイムゾーンを適用
-                    start_time = jst.localize(start_time)
-                    end_time = jst.localize(end_time)
+                    start_time = start_time.replace(tzinfo=JST)
+                    end_time = end_time.replace(tzinfo=JST)
                     total_staff += 1
                     # 現在の時刻がシフト内にある場合は勤務中とカウント
                     if start_time <= current_time <= end_time: